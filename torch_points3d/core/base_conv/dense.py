@@ -76,8 +76,8 @@ class BaseDenseConvolutionDown(BaseConvolution):
         new_pos = pos.gather(1, idx)
 
         ms_x = []
-        for scale_idx in range(self.neighbour_finder.num_scales):
-            radius_idx = self.neighbour_finder(pos, new_pos, scale_idx=scale_idx)
+        ms_radius_idx = self.neighbour_finder.find_neighbours_all_scales(pos, new_pos)
+        for scale_idx, radius_idx in enumerate(ms_radius_idx):
             ms_x.append(self.conv(x, pos, new_pos, radius_idx, scale_idx))
         new_x = torch.cat(ms_x, 1)
 
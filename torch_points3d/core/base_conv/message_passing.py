@@ -81,8 +81,10 @@ class BaseMSConvolutionDown(BaseConvolution):
         batch_obj.idx = idx
 
         ms_x = []
-        for scale_idx in range(self.neighbour_finder.num_scales):
-            row, col = self.neighbour_finder(pos, pos[idx], batch_x=batch, batch_y=batch[idx], scale_idx=scale_idx,)
+        ms_neighbours = self.neighbour_finder.find_neighbours_all_scales(
+            pos, pos[idx], batch_x=batch, batch_y=batch[idx]
+        )
+        for row, col in ms_neighbours:
             edge_index = torch.stack([col, row], dim=0)
 
             ms_x.append(self.conv(x, (pos, pos[idx]), edge_index, batch))
@@ -0,0 +1,69 @@
+import numpy as np
+import torch
+from numba import njit, prange
+
+from torch_points3d.core.spatial_ops._knn_cuda_numba import query_ranges
+
+
+# -------------------------------------------------------------------- #
+#                               CPU KNN                                #
+# -------------------------------------------------------------------- #
+
+# The kernel is compiled lazily on the first CPU search, so processes
+# that never search on CPU do not pay for it. cache=True stores the
+# machine code on disk, so later processes skip the JIT warmup
+@njit(cache=True, nogil=True, fastmath=True, parallel=True)
+def _knn_cpu_kernel(x, y, x_start, x_end, k):
+    """Brute-force KNN, parallelized over queries. Each query keeps its
+    k best candidates in a sorted list. Missing neighbours are -1.
+    """
+    num_y = y.shape[0]
+    d = x.shape[1]
+    out_idx = np.full((num_y, k), -1, dtype=np.int64)
+
+    for q in prange(num_y):
+        best_d = np.full(k, np.inf, dtype=np.float32)
+        best_i = np.full(k, -1, dtype=np.int64)
+        for r in range(x_start[q], x_end[q]):
+            dist = np.float32(0)
+            for c in range(d):
+                diff = x[r, c] - y[q, c]
+                dist += diff * diff
+            if dist >= best_d[k - 1]:
+                continue
+
+            # Insert the candidate in the sorted neighbour list
+            j = k - 1
+            while j > 0 and best_d[j - 1] > dist:
+                best_d[j] = best_d[j - 1]
+                best_i[j] = best_i[j - 1]
+                j -= 1
+            best_d[j] = dist
+            best_i[j] = r
+        out_idx[q] = best_i
+
+    return out_idx
+
+
+def knn_cpu(x, y, k, batch_x=None, batch_y=None):
+    """KNN search on CPU with a parallel numba kernel.
+
+    Batches are expected to be sorted, as in torch_cluster.
+
+    :param x: (num_x, d) CPU tensor of reference points
+    :param y: (num_y, d) CPU tensor of query points
+    :param k: number of neighbours
+    :param batch_x: optional (num_x) batch indices of x
+    :param batch_y: optional (num_y) batch indices of y
+    :return: (2, E) tensor of (y index, x index) pairs
+    """
+    x_start, x_end = query_ranges(x, y, batch_x, batch_y)
+    out_idx = torch.from_numpy(_knn_cpu_kernel(
+        np.ascontiguousarray(x.detach().numpy(), dtype=np.float32),
+        np.ascontiguousarray(y.detach().numpy(), dtype=np.float32),
+        x_start.numpy(), x_end.numpy(), k))
+
+    # Queries with less than k candidates have missing neighbours
+    row = torch.arange(y.shape[0]).unsqueeze(1).expand(-1, k)
+    valid = out_idx >= 0
+    return torch.stack([row[valid], out_idx[valid]], dim=0)
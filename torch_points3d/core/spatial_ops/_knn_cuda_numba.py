@@ -0,0 +1,174 @@
+import math
+import torch
+from numba import cuda, float32, int64
+
+
+# -------------------------------------------------------------------- #
+#                            Kernel settings                           #
+# -------------------------------------------------------------------- #
+
+# Number of queries handled by each block, which is also the number of
+# reference points staged in shared memory at each step
+THREADS_PER_BLOCK = 128
+
+# Compile-time bounds of the per-thread neighbour list and of the point
+# dimension. Queries with larger k or d must use another KNN path. The
+# neighbour list is indexed dynamically, so it lives in local memory
+# rather than in registers, whatever its size
+MAX_K = 128
+MAX_D = 16
+
+
+# -------------------------------------------------------------------- #
+#                             Shared-mem KNN                           #
+# -------------------------------------------------------------------- #
+
+@cuda.jit
+def _knn_sharedmem_kernel(x, y, x_start, x_end, k, out_idx):
+    """Brute-force KNN with O(num_y * k) memory.
+
+    Each thread owns a query and keeps its k best candidates sorted in
+    a local list. The block cooperatively streams the reference points
+    through shared memory, restricted to the union of the reference
+    ranges of its queries.
+    """
+    tile = cuda.shared.array((THREADS_PER_BLOCK, MAX_D), float32)
+    bounds = cuda.shared.array(2, int64)
+    best_d = cuda.local.array(MAX_K, float32)
+    best_i = cuda.local.array(MAX_K, int64)
+    q_pos = cuda.local.array(MAX_D, float32)
+
+    tid = cuda.threadIdx.x
+    q = cuda.blockIdx.x * THREADS_PER_BLOCK + tid
+    d = x.shape[1]
+    active = q < y.shape[0]
+
+    # Reference range of the block
+    if tid == 0:
+        bounds[0] = x.shape[0]
+        bounds[1] = 0
+    cuda.syncthreads()
+    lo = 0
+    hi = 0
+    if active:
+        lo = x_start[q]
+        hi = x_end[q]
+        cuda.atomic.min(bounds, 0, lo)
+        cuda.atomic.max(bounds, 1, hi)
+        for c in range(d):
+            q_pos[c] = y[q, c]
+    for j in range(k):
+        best_d[j] = math.inf
+        best_i[j] = -1
+    cuda.syncthreads()
+    block_lo = bounds[0]
+    block_hi = bounds[1]
+
+    for base in range(block_lo, block_hi, THREADS_PER_BLOCK):
+        # Stage a tile of reference points in shared memory
+        r = base + tid
+        if r < block_hi:
+            for c in range(d):
+                tile[tid, c] = x[r, c]
+        cuda.syncthreads()
+
+        if active:
+            n_tile = min(THREADS_PER_BLOCK, block_hi - base)
+            for t in range(n_tile):
+                r = base + t
+                if r < lo or r >= hi:
+                    continue
+                dist = float32(0)
+                for c in range(d):
+                    diff = tile[t, c] - q_pos[c]
+                    dist += diff * diff
+                if dist >= best_d[k - 1]:
+                    continue
+
+                # Insert the candidate in the sorted neighbour list
+                j = k - 1
+                while j > 0 and best_d[j - 1] > dist:
+                    best_d[j] = best_d[j - 1]
+                    best_i[j] = best_i[j - 1]
+                    j -= 1
+                best_d[j] = dist
+                best_i[j] = r
+        cuda.syncthreads()
+
+    if active:
+        for j in range(k):
+            out_idx[q, j] = best_i[j]
+
+
+def batch_ptr(batch, num_batches):
+    """Start index of each batch item in a sorted batch vector, plus
+    the total size as last entry.
+
+    :param batch: (N) sorted batch indices
+    :param num_batches: number of batch items
+    :return: (num_batches + 1) tensor of item boundaries
+    """
+    ptr = torch.zeros(num_batches + 1, dtype=torch.long, device=batch.device)
+    ptr[1:] = torch.bincount(batch, minlength=num_batches).cumsum(0)
+    return ptr
+
+
+def query_ranges(x, y, batch_x=None, batch_y=None):
+    """Range of reference points searched by each query.
+
+    Batches are expected to be sorted, as in torch_cluster.
+
+    :param x: (num_x, d) tensor of reference points
+    :param y: (num_y, d) tensor of query points
+    :param batch_x: optional (num_x) batch indices of x
+    :param batch_y: optional (num_y) batch indices of y
+    :return: (num_y) start and end indices in x of each query's batch
+    """
+    num_y = y.shape[0]
+    if batch_x is None and batch_y is None:
+        x_start = torch.zeros(num_y, dtype=torch.long, device=y.device)
+        x_end = torch.full((num_y,), x.shape[0], dtype=torch.long, device=y.device)
+        return x_start, x_end
+
+    batch_x = batch_x if batch_x is not None else x.new_zeros(x.shape[0], dtype=torch.long)
+    batch_y = batch_y if batch_y is not None else y.new_zeros(num_y, dtype=torch.long)
+    num_batches = int(max(batch_x.max(), batch_y.max())) + 1
+    ptr = batch_ptr(batch_x, num_batches)
+    return ptr[batch_y].contiguous(), ptr[batch_y + 1].contiguous()
+
+
+def knn_sharedmem(x, y, k, batch_x=None, batch_y=None):
+    """KNN search on CUDA with O(num_y * k) memory, which never
+    materializes the distance matrix. Suited for low-dimensional
+    points, typically point cloud coordinates.
+
+    Batches are expected to be sorted, as in torch_cluster.
+
+    :param x: (num_x, d) CUDA tensor of reference points
+    :param y: (num_y, d) CUDA tensor of query points
+    :param k: number of neighbours, at most MAX_K
+    :param batch_x: optional (num_x) batch indices of x
+    :param batch_y: optional (num_y) batch indices of y
+    :return: (2, E) tensor of (y index, x index) pairs
+    """
+    assert x.is_cuda and y.is_cuda
+    assert x.shape[1] <= MAX_D, f"Points must have at most {MAX_D} dimensions"
+    assert k <= MAX_K, f"k must be at most {MAX_K}"
+
+    x = x.float().contiguous()
+    y = y.float().contiguous()
+    num_y = y.shape[0]
+
+    x_start, x_end = query_ranges(x, y, batch_x, batch_y)
+    out_idx = torch.empty((num_y, k), dtype=torch.long, device=y.device)
+    if num_y > 0:
+        num_blocks = (num_y + THREADS_PER_BLOCK - 1) // THREADS_PER_BLOCK
+        _knn_sharedmem_kernel[num_blocks, THREADS_PER_BLOCK](
+            cuda.as_cuda_array(x), cuda.as_cuda_array(y),
+            cuda.as_cuda_array(x_start), cuda.as_cuda_array(x_end), k,
+            cuda.as_cuda_array(out_idx))
+
+    # Queries with less than k candidates have missing neighbours
+    row = torch.arange(num_y, device=y.device).unsqueeze(1).expand(-1, k)
+    valid = out_idx >= 0
+    return torch.stack([row[valid], out_idx[valid]], dim=0)
@@ -1,18 +1,103 @@
 from abc import ABC, abstractmethod
-from typing import List, Union, cast
+from functools import partial
+from typing import List, Union
 import torch
 import numpy as np
 import faiss
+# Registers torch.Tensor overloads for the FAISS index methods, so CUDA
+# tensors can be passed to GPU indices without host round-trips
+import faiss.contrib.torch_utils
 from torch_geometric.nn import knn, radius
 import torch_points_kernels as tp
+from pykeops.torch import LazyTensor
 
-from torch_points3d.utils.config import is_list
+from torch_points3d.utils.config import is_iterable
 from torch_points3d.utils.enums import ConvolutionFormat
 
 from torch_points3d.utils.debugging_vars import DEBUGGING_VARS, DistributionNeighbour
+from torch_points3d.core.spatial_ops._knn_cuda_numba import knn_sharedmem, batch_ptr, MAX_K as SHAREDMEM_MAX_K, \
+    MAX_D as SHAREDMEM_MAX_D
+from torch_points3d.core.spatial_ops._knn_cpu_numba import knn_cpu
+
+# Module-level alias of the ball query kernel, so the finders do not
+# resolve it through its parent module at every call
+_ball_query = tp.ball_query
+
+_BACKENDS = ("default", "keops")
+
+
+def _check_backend(backend):
+    backend = backend.lower()
+    if backend not in _BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {_BACKENDS}")
+    return backend
+
+
+def _is_sorted(batch):
+    return batch is None or batch.shape[0] < 2 or bool((batch[1:] >= batch[:-1]).all())
+
+
+def _search_sorted(search, x, y, batch_x, batch_y):
+    """Run a (2, E) neighbour search on batch-sorted inputs.
+
+    The batched search kernels expect each batch item to be a contiguous
+    segment. Unsorted inputs are sorted by batch before the search and
+    the resulting indices are mapped back to the original ordering.
+    Sorted inputs, the usual case, only pay for the sortedness check.
+    """
+    perm_x = perm_y = None
+    if not _is_sorted(batch_x):
+        batch_x, perm_x = batch_x.sort()
+        x = x[perm_x]
+    if not _is_sorted(batch_y):
+        batch_y, perm_y = batch_y.sort()
+        y = y[perm_y]
+    if perm_x is None and perm_y is None:
+        return search(x, y, batch_x, batch_y)
+
+    row, col = search(x, y, batch_x, batch_y)
+    row = perm_y[row] if perm_y is not None else row
+    col = perm_x[col] if perm_x is not None else col
+    return torch.stack([row, col], dim=0)
+
+
+def _keops_sqdist(x, y, batch_x=None, batch_y=None):
+    """Symbolic (num_y, num_x) squared distances with KeOps. Reductions
+    on the returned LazyTensor are fused in a single CUDA kernel and
+    never materialize the distance matrix.
+
+    Batches are expected to be sorted, as in torch_cluster, and are
+    expressed as block-diagonal KeOps ranges.
+    """
+    y_i = LazyTensor(y.contiguous()[:, None, :])
+    x_j = LazyTensor(x.contiguous()[None, :, :])
+    d2_ij = ((y_i - x_j) ** 2).sum(-1)
+
+    if batch_x is not None or batch_y is not None:
+        batch_x = batch_x if batch_x is not None else x.new_zeros(x.shape[0], dtype=torch.long)
+        batch_y = batch_y if batch_y is not None else y.new_zeros(y.shape[0], dtype=torch.long)
+        num_batches = int(max(batch_x.max(), batch_y.max())) + 1
+
+        def ranges_slices(batch):
+            ptr = torch.zeros(num_batches + 1, dtype=torch.long, device=batch.device)
+            ptr[1:] = torch.bincount(batch, minlength=num_batches).cumsum(0)
+            ranges = torch.stack((ptr[:-1], ptr[1:])).t().int().contiguous()
+            slices = (1 + torch.arange(num_batches, device=batch.device)).int()
+            return ranges, slices
+
+        ranges_y, slices_y = ranges_slices(batch_y)
+        ranges_x, slices_x = ranges_slices(batch_x)
+        d2_ij.ranges = (ranges_y, slices_y, ranges_x, ranges_x, slices_x, ranges_y)
+
+    return d2_ij
 
 
 class BaseNeighbourFinder(ABC):
+    # Attributes holding cached indices, GPU resources or tensors. These
+    # may be large and are left out of the representation, along with
+    # the search callables bound to the finder itself
+    _REPR_EXCLUDED_PREFIXES = ("_index", "_res", "_cache", "_search")
+
     def __call__(self, x, y, batch_x, batch_y):
         return self.find_neighbours(x, y, batch_x, batch_y)
 
@@ -21,36 +106,283 @@ class BaseNeighbourFinder(ABC):
         pass
 
     def __repr__(self):
-        return str(self.__class__.__name__) + " " + str(self.__dict__)
+        attrs = {k: v for k, v in self.__dict__.items() if not k.startswith(self._REPR_EXCLUDED_PREFIXES)}
+        return str(self.__class__.__name__) + " " + str(attrs)
 
 
 class RadiusNeighbourFinder(BaseNeighbourFinder):
-    def __init__(self, radius: float, max_num_neighbors: int = 64, conv_type=ConvolutionFormat.MESSAGE_PASSING.value):
+    def __init__(
+        self,
+        radius: float,
+        max_num_neighbors: int = 64,
+        conv_type=ConvolutionFormat.MESSAGE_PASSING.value,
+        backend="default",
+    ):
+        """ backend="keops" searches the max_num_neighbors nearest
+        neighbours with a KeOps reduction and drops those beyond radius.
+        It is only available for the message passing format.
+        """
         self._radius = radius
         self._max_num_neighbors = max_num_neighbors
         self._conv_type = conv_type.lower()
+        self._backend = _check_backend(backend)
 
-    def find_neighbours(self, x, y, batch_x=None, batch_y=None):
+        # The search is resolved once here rather than at every call.
+        # Batched radius searches expect batch-sorted inputs
         if self._conv_type == ConvolutionFormat.MESSAGE_PASSING.value:
-            return radius(x, y, self._radius, batch_x, batch_y, max_num_neighbors=self._max_num_neighbors)
-        elif self._conv_type == ConvolutionFormat.DENSE.value or ConvolutionFormat.PARTIAL_DENSE.value:
-            return tp.ball_query(
-                self._radius, self._max_num_neighbors, x, y, mode=self._conv_type, batch_x=batch_x, batch_y=batch_y
-            )[0]
+            search = self._radius_keops if self._backend == "keops" else self._radius_mp
+            self._search = partial(_search_sorted, search)
+        elif self._conv_type in (ConvolutionFormat.DENSE.value, ConvolutionFormat.PARTIAL_DENSE.value):
+            if self._backend == "keops":
+                raise NotImplementedError("The KeOps backend only supports the message passing format")
+            self._search = self._ball_query_dense
         else:
-            raise NotImplementedError
+            raise NotImplementedError(f"RadiusNeighbourFinder does not support conv_type '{self._conv_type}'")
+
+    def find_neighbours(self, x, y, batch_x=None, batch_y=None):
+        return self._search(x, y, batch_x, batch_y)
+
+    def _radius_mp(self, x, y, batch_x, batch_y):
+        return radius(x, y, self._radius, batch_x, batch_y, max_num_neighbors=self._max_num_neighbors)
+
+    def _ball_query_dense(self, x, y, batch_x, batch_y):
+        # Dense and partial dense layouts share the same kernel, which
+        # dispatches internally on `mode`
+        return _ball_query(
+            self._radius, self._max_num_neighbors, x, y, mode=self._conv_type, batch_x=batch_x, batch_y=batch_y
+        )[0]
+
+    def _radius_keops(self, x, y, batch_x, batch_y):
+        k = min(self._max_num_neighbors, x.shape[0])
+        d2, col = _keops_sqdist(x, y, batch_x, batch_y).Kmin_argKmin(k, dim=1)
+        row = torch.arange(y.shape[0], device=y.device).unsqueeze(1).expand(-1, k)
+        valid = d2 <= self._radius ** 2
+        return torch.stack([row[valid], col[valid]], dim=0)
 
 
 class KNNNeighbourFinder(BaseNeighbourFinder):
-    def __init__(self, k):
+    def __init__(
+        self,
+        k,
+        gemm_min_points=3500,
+        gemm_tile_size=2 ** 26,
+        use_sharedmem=False,
+        backend="default",
+        cpu_brute_force_size=2 ** 24,
+    ):
+        """
+        KNN search with torch_cluster.
+
+        For large clouds on GPU, the search is carried as a brute-force
+        tiled GEMM followed by a topk, which makes better use of the
+        GPU than the per-query torch_cluster kernel. Each batch item is
+        searched separately, after centring it on the mean of its x.
+
+        gemm_min_points is the minimum number of points in x for which
+        the GEMM path is used.
+
+        gemm_tile_size is the maximum number of entries of each tile of
+        the (num_y, num_x) distance matrix, this bounds the memory used
+        by the GEMM path.
+
+        use_sharedmem enables, for CUDA inputs, a brute-force kernel
+        streaming reference points through shared memory and keeping
+        per-query neighbours in a per-thread local array. It uses
+        O(num_y * k) memory and is faster than GEMM for low-dimensional
+        points. It falls back to the other paths when d or k exceed the
+        kernel bounds.
+
+        cpu_brute_force_size is the maximum number of (x, y) pairs for
+        which CPU inputs are searched with a brute-force parallel numba
+        kernel. Larger CPU searches use the torch_cluster tree search.
+
+        backend="keops" runs the search as a KeOps argKmin reduction
+        instead, with O(num_y * k) memory, on CPU or GPU.
+        """
         self.k = k
+        self.gemm_min_points = gemm_min_points
+        self.gemm_tile_size = gemm_tile_size
+        self.use_sharedmem = use_sharedmem
+        self.backend = _check_backend(backend)
+        self.cpu_brute_force_size = cpu_brute_force_size
 
     def find_neighbours(self, x, y, batch_x, batch_y):
+        return _search_sorted(self._search, x, y, batch_x, batch_y)
+
+    def _search(self, x, y, batch_x, batch_y):
+        if self.backend == "keops":
+            return self._knn_keops(x, y, batch_x, batch_y)
+        if self.use_sharedmem and x.is_cuda and x.shape[1] <= SHAREDMEM_MAX_D and self.k <= SHAREDMEM_MAX_K:
+            return knn_sharedmem(x, y, self.k, batch_x, batch_y)
+        if x.is_cuda and x.shape[0] >= self.gemm_min_points:
+            return self._knn_gemm(x, y, batch_x, batch_y)
+        if not x.is_cuda and x.shape[0] * y.shape[0] <= self.cpu_brute_force_size:
+            return knn_cpu(x, y, self.k, batch_x, batch_y)
         return knn(x, y, self.k, batch_x, batch_y)
 
+    def _knn_keops(self, x, y, batch_x, batch_y):
+        k = min(self.k, x.shape[0])
+        d2, col = _keops_sqdist(x, y, batch_x, batch_y).Kmin_argKmin(k, dim=1)
+        row = torch.arange(y.shape[0], device=y.device).unsqueeze(1).expand(-1, k)
+
+        # Batch items with less than k points leave reduction slots
+        # without candidate, with infinite distances
+        valid = torch.isfinite(d2)
+        return torch.stack([row[valid], col[valid]], dim=0)
+
+    def _knn_gemm(self, x, y, batch_x, batch_y):
+        # Batch items are searched independently, on their own segment
+        # of the sorted x and y
+        if batch_x is None and batch_y is None:
+            return self._knn_gemm_item(x, y)
+
+        batch_x = batch_x if batch_x is not None else x.new_zeros(x.shape[0], dtype=torch.long)
+        batch_y = batch_y if batch_y is not None else y.new_zeros(y.shape[0], dtype=torch.long)
+        num_batches = int(max(batch_x.max(), batch_y.max())) + 1
+        ptr_x = batch_ptr(batch_x, num_batches).tolist()
+        ptr_y = batch_ptr(batch_y, num_batches).tolist()
+        rows, cols = [], []
+        for i in range(num_batches):
+            if ptr_x[i] == ptr_x[i + 1] or ptr_y[i] == ptr_y[i + 1]:
+                continue
+            row, col = self._knn_gemm_item(x[ptr_x[i]:ptr_x[i + 1]], y[ptr_y[i]:ptr_y[i + 1]]).unbind(0)
+            rows.append(row + ptr_y[i])
+            cols.append(col + ptr_x[i])
+        if len(rows) == 0:
+            return torch.empty((2, 0), dtype=torch.long, device=y.device)
+        return torch.stack([torch.cat(rows), torch.cat(cols)], dim=0)
+
+    def _knn_gemm_item(self, x, y):
+        # Squared distances are computed as |x|^2 - 2 y.x, the |y|^2
+        # term being constant for each query it does not affect the
+        # ranking. Points are centred on the mean of x beforehand, the
+        # expansion losing float32 precision far from the origin.
+        # Queries are processed in tiles to bound memory
+        k = min(self.k, x.shape[0])
+        tile = max(1, self.gemm_tile_size // x.shape[0])
+        center = x.mean(dim=0, keepdim=True)
+        x = x - center
+        y = y - center
+
+        xx = (x * x).sum(dim=1).unsqueeze(0)
+        x_t = x.t()
+        rows, cols = [], []
+        for start in range(0, y.shape[0], tile):
+            end = min(start + tile, y.shape[0])
+            d2 = torch.addmm(xx, y[start:end], x_t, alpha=-2)
+            col = d2.topk(k, dim=1, largest=False)[1]
+            row = torch.arange(start, end, device=y.device).unsqueeze(1).expand(-1, k)
+            rows.append(row.reshape(-1))
+            cols.append(col.reshape(-1))
+
+        return torch.stack([torch.cat(rows), torch.cat(cols)], dim=0)
+
+
+class BaseFAISSKNNNeighbourFinder(BaseNeighbourFinder):
+    """
+    Base class for KNN with Facebook AI Similarity Search.
+
+    The last fitted index is cached along with the fingerprint of the
+    cloud it was fitted on, to skip index construction when the same
+    cloud is queried repeatedly.
+
+    query_chunk controls the maximum number of queries passed to a
+    single FAISS search. FAISS parallelizes batched queries far more
+    efficiently than successive small searches, so chunks should be as
+    large as memory allows.
 
-class FAISSGPUKNNNeighbourFinder(BaseNeighbourFinder):
-    def __init__(self, k, ncells=None, nprobes=10):
+    index_dtype controls the dtype of the returned neighbour indices.
+    FAISS produces int64 indices, torch.int32 halves the memory of the
+    output and of downstream gathers for clouds of less than 2**31
+    points, but consumers must accept int32 indices.
+    """
+
+    def __init__(self, k, query_chunk=200000, index_dtype=torch.long):
+        if index_dtype not in (torch.int32, torch.int64):
+            raise ValueError(f"index_dtype must be torch.int32 or torch.int64, got {index_dtype}")
+        self.k = k
+        self.query_chunk = query_chunk
+        self.index_dtype = index_dtype
+        self._index = None
+        self._index_key = None
+        self._index_x = None
+
+    @staticmethod
+    def _fingerprint(x):
+        # Cheap identity of the fitted cloud. The version counter catches
+        # in-place modifications, and holding a reference to the fitted
+        # tensor in `_index_x` guarantees its memory cannot be recycled
+        # by another tensor with the same data_ptr
+        return x.data_ptr(), tuple(x.shape), x.stride(), x.dtype, x.device, x._version
+
+    @staticmethod
+    def _as_faiss_input(x):
+        # FAISS consumes contiguous float32 arrays. Compliant inputs are
+        # used as is, others are cast and made contiguous in a single copy
+        if x.dtype == torch.float32 and x.is_contiguous():
+            return x
+        return torch.empty(x.shape, dtype=torch.float32, device=x.device).copy_(x)
+
+    @abstractmethod
+    def _build_index(self, x):
+        pass
+
+    def _search(self, y, k):
+        # The torch_utils overloads let FAISS consume and fill tensors
+        # directly on the query's device. Queries are searched in large
+        # chunks written in-place into the output buffers, to bound the
+        # memory of a single search
+        n_query = y.shape[0]
+        D = torch.empty((n_query, k), dtype=torch.float32, device=y.device)
+        I = torch.empty((n_query, k), dtype=torch.int64, device=y.device)
+        for start in range(0, n_query, self.query_chunk):
+            end = min(start + self.query_chunk, n_query)
+            self._index.search(y[start:end], k, D=D[start:end], I=I[start:end])
+        return I
+
+    def find_neighbours(self, x, y, batch_x, batch_y):
+        if batch_x is not None or batch_y is not None:
+            raise NotImplementedError(f"{self.__class__.__name__} does not support batches yet")
+
+        x = x.view(-1, 1) if x.dim() == 1 else x
+        y = y.view(-1, 1) if y.dim() == 1 else y
+
+        # Heuristics to prevent k from being too large
+        n_fit = x.shape[0]
+        k_max = 1024
+        k = min(self.k, n_fit, k_max)
+
+        if self.index_dtype == torch.int32 and n_fit >= 2 ** 31:
+            raise ValueError(f"Cannot index {n_fit} points with int32 indices")
+
+        # Only (re)build the index if the fitted cloud changed. The
+        # fingerprint is taken on the input tensor, so that inputs
+        # needing a conversion still hit the cache
+        key = self._fingerprint(x)
+        if self._index is None or key != self._index_key:
+            self._index = None
+            self._index = self._build_index(self._as_faiss_input(x))
+            self._index_key = key
+            self._index_x = x
+
+        # Device transfer and index cast are fused in a single op
+        return self._search(self._as_faiss_input(y), k).to(device=x.device, dtype=self.index_dtype)
+
+
+class FAISSGPUKNNNeighbourFinder(BaseFAISSKNNNeighbourFinder):
+    _INDEX_TYPES = ("ivfflat", "ivfpq", "ivfsq")
+
+    def __init__(
+        self,
+        k,
+        ncells=None,
+        nprobes=10,
+        index_type="ivfflat",
+        pq_m=None,
+        query_chunk=200000,
+        sort_queries=False,
+        index_dtype=torch.long,
+    ):
         """
         KNN on GPU with Facebook AI Similarity Search.
 
@@ -65,8 +397,9 @@ class FAISSGPUKNNNeighbourFinder(BaseNeighbourFinder):
         ncells controls the number of Voronoi cells created to divide
         the search space. These are built with k-means on the training
         set and act as the leaves of a kdtree. A heuristic was built to
-        meet needs of two regimes, one for 'small' datasets of <10**7
-        points and the other for 'larger' datasets of >10**7 points.
+        meet needs of two regimes, 1.6 * sqrt(n) cells for 'small'
+        datasets of <2*10**6 points and 3.5 * sqrt(n) cells for 'larger'
+        datasets of >3*10**6 points, linearly blended in between.
         ncells may not be optimal for any dataset, this does not affect
         accuracy much, but does affect speed.
 
@@ -75,33 +408,44 @@ class FAISSGPUKNNNeighbourFinder(BaseNeighbourFinder):
 
         setting nprobes=1 is faster but causes erroneous neighborhoods
         at Voronoi cells boundaries.
+
+        index_type controls how the vectors are stored in the inverted
+        lists, which is what the memory-bound search scans:
+            - 'ivfflat': full fp32 vectors, exact distances
+            - 'ivfpq': product quantization with pq_m sub-quantizers of
+            8 bits each. pq_m must divide the dimension and defaults to
+            its largest divisor <= 16
+            - 'ivfsq': fp16 scalar quantization, halves the footprint
+            for a negligible recall loss
+
+        query_chunk controls the maximum number of queries passed to a
+        single FAISS search.
+
+        sort_queries orders the queries by their nearest Voronoi cell
+        before searching, so that consecutive queries probe the same
+        inverted lists. This costs an extra coarse assignment and sort
+        of the queries, and does not change the results.
+
+        index_dtype controls the dtype of the returned neighbour indices,
+        see BaseFAISSKNNNeighbourFinder.
         """
-        self.k = k
+        super().__init__(k, query_chunk=query_chunk, index_dtype=index_dtype)
+        index_type = index_type.lower()
+        if index_type not in self._INDEX_TYPES:
+            raise ValueError(f"Unknown index_type '{index_type}', expected one of {self._INDEX_TYPES}")
         self.ncells = ncells
         self.nprobes = nprobes
+        self.index_type = index_type
+        self.pq_m = pq_m
+        self.sort_queries = sort_queries
 
-    def find_neighbours(self, x, y, batch_x, batch_y):
-        if batch_x is not None or batch_y is not None:
-            raise NotImplementedError(
-                "FAISSGPUKNNNeighbourFinder does not support batches yet")
-
-        x = x.view(-1, 1) if x.dim() == 1 else x
-        y = y.view(-1, 1) if y.dim() == 1 else y
-        x, y = x.contiguous(), y.contiguous()
-
-        # FAISS-GPU consumes numpy arrays
-        x_np = x.cpu().numpy()
-        y_np = y.cpu().numpy()
-
-        # Initialization
-        n_fit = x_np.shape[0]
-        d = x_np.shape[1]
-        nprobe = self.nprobes
-        gpu = faiss.StandardGpuResources()
+        # GPU resources are expensive to allocate, so they are created
+        # once and shared by all the indices built by this finder
+        self._res = faiss.StandardGpuResources()
 
-        # Heuristics to prevent k from being too large
-        k_max = 1024
-        k = min(self.k, n_fit, k_max)
+    def _build_index(self, x):
+        n_fit, d = x.shape
+        device_id = x.device.index if x.is_cuda and x.device.index is not None else 0
 
         # Heuristic to parameterize the number of cells for FAISS index,
         # if not provided
@@ -109,42 +453,139 @@ class FAISSGPUKNNNeighbourFinder(BaseNeighbourFinder):
         if ncells is None:
             f1 = 3.5 * np.sqrt(n_fit)
             f2 = 1.6 * np.sqrt(n_fit)
-            if n_fit > 2 * 10 ** 6:
-                p = 1 / (1 + np.exp(2 * 10 ** 6 - n_fit))
-            else:
-                p = 0
+            p = min(1.0, max(0.0, (n_fit - 2 * 10 ** 6) / 10 ** 6))
             ncells = int(p * f1 + (1 - p) * f2)
 
-        # Building a GPU IVFFlat index + Flat quantizer
-        torch.cuda.empty_cache()
-        quantizer = faiss.IndexFlatL2(d)  # the quantizer index
-        index = faiss.IndexIVFFlat(quantizer, d, ncells, faiss.METRIC_L2)  # the main index
-        gpu_index_flat = faiss.index_cpu_to_gpu(gpu, 0, index)  # pass index it to GPU
-        gpu_index_flat.train(x_np)  # fit the cells to the training set distribution
-        gpu_index_flat.add(x_np)
+        # Building a GPU IVF index with a Flat quantizer and the
+        # required inverted lists encoding
+        if self.index_type == "ivfpq":
+            m = self.pq_m
+            if m is None:
+                m = max(i for i in range(1, min(d, 16) + 1) if d % i == 0)
+            if d % m != 0:
+                raise ValueError(f"pq_m={m} must divide the dimension d={d}")
+            encoding = f"PQ{m}x8"
+        elif self.index_type == "ivfsq":
+            encoding = "SQfp16"
+        else:
+            encoding = "Flat"
+        index = faiss.index_factory(d, f"IVF{ncells},{encoding}", faiss.METRIC_L2)
+        gpu_index = faiss.index_cpu_to_gpu(self._res, device_id, index)  # pass index it to GPU
+        gpu_index.train(x)  # fit the cells to the training set distribution
+        gpu_index.add(x)
+        return gpu_index
+
+    def _search(self, y, k):
+        self._index.nprobe = self.nprobes
+        if not self.sort_queries:
+            return super()._search(y, k)
+
+        # Search the queries in Voronoi cell order, then restore the
+        # original query order
+        # The quantizer comes back from SWIG as a plain faiss.Index proxy
+        # and must be downcast to its GPU class to accept CUDA tensors.
+        # A CPU quantizer is fed with CPU queries instead
+        quantizer = faiss.downcast_index(self._index.quantizer)
+        y_quantizer = y if hasattr(quantizer, "getDevice") else y.cpu()
+        cells = quantizer.search(y_quantizer, 1)[1].view(-1).to(y.device)
+        order = cells.argsort()
+        I_sorted = super()._search(y[order], k)
+        I = torch.empty_like(I_sorted)
+        I[order] = I_sorted
+        return I
+
+
+class FAISSCPUKNNNeighbourFinder(BaseFAISSKNNNeighbourFinder):
+    def __init__(self, k, M=32, efConstruction=40, efSearch=16, query_chunk=200000, index_dtype=torch.long):
+        """
+        KNN on CPU with Facebook AI Similarity Search.
+
+        Relies on a Hierarchical Navigable Small World graph index,
+        which requires no training and is typically faster than IVF
+        indices on CPU for small k.
+
+        M controls the number of neighbours of each node in the graph.
+        The larger, the more accurate but the more memory-hungry.
+
+        efConstruction controls the exploration depth when building the
+        graph. The larger, the better the graph but the slower the
+        construction.
+
+        efSearch controls the exploration depth at search time. The
+        larger, the slower but also the more accurate the neighbors. It
+        is raised to k if needed.
+
+        query_chunk and index_dtype are described in
+        BaseFAISSKNNNeighbourFinder.
+        """
+        super().__init__(k, query_chunk=query_chunk, index_dtype=index_dtype)
+        self.M = M
+        self.efConstruction = efConstruction
+        self.efSearch = efSearch
+
+    @staticmethod
+    def _as_faiss_input(x):
+        # CPU indices only consume CPU tensors
+        return BaseFAISSKNNNeighbourFinder._as_faiss_input(x.cpu())
+
+    def _build_index(self, x):
+        index = faiss.IndexHNSWFlat(x.shape[1], self.M)
+        index.hnsw.efConstruction = self.efConstruction
+        index.add(x)
+        return index
+
+    def _search(self, y, k):
+        self._index.hnsw.efSearch = max(self.efSearch, k)
+        return super()._search(y, k)
+
 
-        # Querying the K-NN
-        gpu_index_flat.setNumProbes(nprobe)
-        return torch.LongTensor(gpu_index_flat.search(y_np, k)[1]).to(x.device)
+def faiss_knn_neighbour_finder(k, use_gpu=None, **kwargs):
+    """
+    Build a FAISS KNN neighbour finder, on GPU if use_gpu or, by
+    default, if CUDA and FAISS GPU support are available. Remaining
+    keyword arguments are passed to FAISSGPUKNNNeighbourFinder or
+    FAISSCPUKNNNeighbourFinder.
+    """
+    if use_gpu is None:
+        use_gpu = torch.cuda.is_available() and hasattr(faiss, "StandardGpuResources")
+    if use_gpu:
+        return FAISSGPUKNNNeighbourFinder(k, **kwargs)
+    return FAISSCPUKNNNeighbourFinder(k, **kwargs)
 
 
 class DilatedKNNNeighbourFinder(BaseNeighbourFinder):
-    def __init__(self, k, dilation):
+    def __init__(self, k, dilation, index_dtype=torch.long):
+        """
+        KNN search keeping k random neighbours among the k * dilation
+        nearest ones.
+
+        index_dtype controls the dtype of the returned row and col
+        indices. torch.int32 halves their memory for clouds of less than
+        2**31 points, but consumers must accept int32 indices.
+        """
+        if index_dtype not in (torch.int32, torch.int64):
+            raise ValueError(f"index_dtype must be torch.int32 or torch.int64, got {index_dtype}")
         self.k = k
         self.dilation = dilation
+        self.index_dtype = index_dtype
         self.initialFinder = KNNNeighbourFinder(k * dilation)
 
     def find_neighbours(self, x, y, batch_x, batch_y):
         # find the self.k * self.dilation closest neighbours in x for each y
         row, col = self.initialFinder.find_neighbours(x, y, batch_x, batch_y)
 
-        # for each point in y, randomly select k of its neighbours
-        index = torch.randint(self.k * self.dilation, (len(y), self.k), device=row.device, dtype=torch.long,)
+        # for each point in y, randomly select k of its neighbours, by
+        # gathering directly in the (len(y), k * dilation) neighbourhoods.
+        # Each neighbourhood row holds a single query index, so the
+        # sampled rows are simply its first k entries
+        num_y = len(y)
+        kd = self.k * self.dilation
+        index = torch.randint(kd, (num_y, self.k), device=row.device, dtype=torch.long,)
+        row = row.view(num_y, kd)[:, :self.k].reshape(-1)
+        col = col.view(num_y, kd).gather(1, index).view(-1)
 
-        arange = torch.arange(len(y), dtype=torch.long, device=row.device)
-        arange = arange * (self.k * self.dilation)
-        index = (index + arange.view(-1, 1)).view(-1)
-        row, col = row[index], col[index]
+        if self.index_dtype != torch.long:
+            row, col = row.to(self.index_dtype), col.to(self.index_dtype)
 
         return row, col
 
@@ -157,6 +598,14 @@ class BaseMSNeighbourFinder(ABC):
     def find_neighbours(self, x, y, batch_x=None, batch_y=None, scale_idx=0):
         pass
 
+    def find_neighbours_all_scales(self, x, y, batch_x=None, batch_y=None):
+        """ Neighbours of y in x for every scale, as a tuple indexed by
+        scale
+        """
+        return tuple(
+            self.find_neighbours(x, y, batch_x=batch_x, batch_y=batch_y, scale_idx=i) for i in range(self.num_scales)
+        )
+
     @property
     @abstractmethod
     def num_scales(self):
@@ -175,45 +624,44 @@ class MultiscaleRadiusNeighbourFinder(BaseMSNeighbourFinder):
 
         Keyword Arguments:
             max_num_neighbors {Union[int, List[int]]}  (default: {64})
+            fuse_scales {bool} -- find_neighbours_all_scales runs a single
+                search at the largest radius and filters it for the smaller
+                ones. Results match the per-scale searches as long as the
+                largest-radius search is not truncated by its
+                max_num_neighbors  (default: {False})
 
         Raises:
             ValueError: [description]
     """
 
     def __init__(
-        self, radius: Union[float, List[float]], max_num_neighbors: Union[int, List[int]] = 64,
+        self,
+        radius: Union[float, List[float]],
+        max_num_neighbors: Union[int, List[int]] = 64,
+        fuse_scales: bool = False,
     ):
+        self._radius, self._max_num_neighbors = self._normalize(radius, max_num_neighbors)
+        self._fuse_scales = fuse_scales
+
         if DEBUGGING_VARS["FIND_NEIGHBOUR_DIST"]:
-            if not isinstance(radius, list):
-                radius = [radius]
-            self._dist_meters = [DistributionNeighbour(r) for r in radius]
-            if not isinstance(max_num_neighbors, list):
-                max_num_neighbors = [max_num_neighbors]
-            max_num_neighbors = [256 for _ in max_num_neighbors]
-
-        if not is_list(max_num_neighbors) and is_list(radius):
-            self._radius = cast(list, radius)
-            max_num_neighbors = cast(int, max_num_neighbors)
-            self._max_num_neighbors = [max_num_neighbors for i in range(len(self._radius))]
-            return
-
-        if not is_list(radius) and is_list(max_num_neighbors):
-            self._max_num_neighbors = cast(list, max_num_neighbors)
-            radius = cast(int, radius)
-            self._radius = [radius for i in range(len(self._max_num_neighbors))]
-            return
-
-        if is_list(max_num_neighbors):
-            max_num_neighbors = cast(list, max_num_neighbors)
-            radius = cast(list, radius)
-            if len(max_num_neighbors) != len(radius):
-                raise ValueError("Both lists max_num_neighbors and radius should be of the same length")
-            self._max_num_neighbors = max_num_neighbors
-            self._radius = radius
-            return
-
-        self._max_num_neighbors = [cast(int, max_num_neighbors)]
-        self._radius = [cast(int, radius)]
+            self._dist_meters = [DistributionNeighbour(r) for r in self._radius]
+            self._max_num_neighbors = (256,) * len(self._radius)
+
+    @staticmethod
+    def _normalize(radius, max_num_neighbors):
+        """Broadcast radius and max_num_neighbors to per-scale tuples.
+        Tuples keep the scale lookup cheap and make the configuration
+        hashable.
+        """
+        if not is_iterable(radius) and not is_iterable(max_num_neighbors):
+            return (radius,), (max_num_neighbors,)
+        if not is_iterable(max_num_neighbors):
+            return tuple(radius), (max_num_neighbors,) * len(radius)
+        if not is_iterable(radius):
+            return (radius,) * len(max_num_neighbors), tuple(max_num_neighbors)
+        if len(max_num_neighbors) != len(radius):
+            raise ValueError("Both lists max_num_neighbors and radius should be of the same length")
+        return tuple(radius), tuple(max_num_neighbors)
 
     def find_neighbours(self, x, y, batch_x=None, batch_y=None, scale_idx=0):
         if scale_idx >= self.num_scales:
@@ -224,6 +672,28 @@ class MultiscaleRadiusNeighbourFinder(BaseMSNeighbourFinder):
         )
         return radius_idx
 
+    def find_neighbours_all_scales(self, x, y, batch_x=None, batch_y=None):
+        if not self._fuse_scales or self.num_scales == 1:
+            return super().find_neighbours_all_scales(x, y, batch_x=batch_x, batch_y=batch_y)
+
+        # Single search with the largest radius and neighbourhood size
+        row, col = radius(x, y, max(self._radius), batch_x, batch_y, max_num_neighbors=max(self._max_num_neighbors))
+        d2 = ((x[col] - y[row]) ** 2).sum(-1)
+
+        # Keep, for each scale, the neighbours within the scale radius
+        # and at most max_num_neighbors per query. torch_cluster returns
+        # neighbours grouped by query, so the rank of a neighbour in its
+        # group is its offset from the group start
+        neighbours = []
+        for r, max_num_neighbors in zip(self._radius, self._max_num_neighbors):
+            valid = d2 < r ** 2
+            row_s, col_s = row[valid], col[valid]
+            counts = torch.bincount(row_s, minlength=y.shape[0])
+            rank = torch.arange(row_s.shape[0], device=row_s.device) - (counts.cumsum(0) - counts)[row_s]
+            keep = rank < max_num_neighbors
+            neighbours.append(torch.stack([row_s[keep], col_s[keep]], dim=0))
+        return tuple(neighbours)
+
     @property
     def num_scales(self):
         return len(self._radius)
@@ -242,17 +712,44 @@ class DenseRadiusNeighbourFinder(MultiscaleRadiusNeighbourFinder):
         if scale_idx >= self.num_scales:
             raise ValueError("Scale %i is out of bounds %i" % (scale_idx, self.num_scales))
         num_neighbours = self._max_num_neighbors[scale_idx]
-        neighbours = tp.ball_query(self._radius[scale_idx], num_neighbours, x, y)[0]
+        neighbours = _ball_query(self._radius[scale_idx], num_neighbours, x, y)[0]
 
         if DEBUGGING_VARS["FIND_NEIGHBOUR_DIST"]:
-            for i in range(neighbours.shape[0]):
-                start = neighbours[i, :, 0]
-                valid_neighbours = (neighbours[i, :, 1:] != start.view((-1, 1)).repeat(1, num_neighbours - 1)).sum(
-                    1
-                ) + 1
-                self._dist_meters[scale_idx].add_valid_neighbours(valid_neighbours)
+            # ball_query pads missing neighbours with the first one
+            valid_neighbours = (neighbours[..., 1:] != neighbours[..., :1]).sum(-1) + 1
+            self._dist_meters[scale_idx].add_valid_neighbours(valid_neighbours.cpu())
         return neighbours
 
+    def find_neighbours_all_scales(self, x, y):
+        if not self._fuse_scales or self.num_scales == 1 or DEBUGGING_VARS["FIND_NEIGHBOUR_DIST"]:
+            return tuple(self.find_neighbours(x, y, scale_idx=i) for i in range(self.num_scales))
+
+        # Single ball query with the largest radius and neighbourhood size
+        idx = _ball_query(max(self._radius), max(self._max_num_neighbors), x, y)[0]
+        num_batches, num_queries, k_max = idx.shape
+        # ball_query returns int32 indices on CUDA, which gather does not
+        # accept. The per-scale outputs keep the original index dtype
+        grouped = x.gather(1, idx.long().view(num_batches, -1, 1).expand(-1, -1, x.shape[-1]))
+        d2 = ((grouped.view(num_batches, num_queries, k_max, -1) - y.unsqueeze(2)) ** 2).sum(-1)
+
+        # For each scale, move the neighbours within the scale radius to
+        # the front, keeping their order, and pad with the first one
+        # like ball_query does. Invalid or overflowing neighbours are
+        # scattered to a discarded extra slot
+        neighbours = []
+        for r, num_neighbours in zip(self._radius, self._max_num_neighbors):
+            valid = d2 < r ** 2
+            pos = valid.long().cumsum(-1) - 1
+            pos = torch.where(valid & (pos < num_neighbours), pos, torch.full_like(pos, num_neighbours))
+            # Queries without neighbour in the scale radius are padded
+            # with 0, like ball_query does
+            first = idx.gather(-1, valid.long().argmax(-1, keepdim=True))
+            first = first.masked_fill(~valid.any(-1, keepdim=True), 0)
+            out = first.expand(-1, -1, num_neighbours + 1).clone()
+            out.scatter_(-1, pos, idx)
+            neighbours.append(out[..., :num_neighbours].contiguous())
+        return tuple(neighbours)
+
     def __call__(self, x, y, scale_idx=0, **kwargs):
         """ Dense interface of the neighboorhood finder
         """
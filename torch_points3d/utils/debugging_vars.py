@@ -41,8 +41,7 @@ class DistributionNeighbour(object):
         return self._histogram[:idx]
 
     def add_valid_neighbours(self, points):
-        for num_valid in points:
-            self._histogram[num_valid] += 1
+        np.add.at(self._histogram, np.asarray(points).reshape(-1), 1)
 
     def __repr__(self):
         return "{}(radius={}, bins={})".format(self.__class__.__name__, self._radius, self._bins)